@@ -1,4 +1,9 @@
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
 from flask import Flask, request, jsonify, make_response
 
 from content_bot import run_once
@@ -7,6 +12,14 @@ app = Flask(__name__)
 
 JOB_TOKEN = os.environ.get("JOB_TOKEN", "").strip()
 
+# run_once corre en segundo plano: OpenAI puede tardar minutos y no debe
+# retener un hilo web. Los jobs viven en memoria del proceso (gunicorn: 1 worker).
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_TTL_SECONDS = 60 * 60  # jobs terminados se olvidan tras 1 h
+_EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+JOBS = {}  # job_id -> (creado_en, Future)
+_JOBS_LOCK = threading.Lock()
+
 def _cors_json(payload, status=200):
     resp = make_response(jsonify(payload), status)
     resp.headers["Access-Control-Allow-Origin"] = "*"
@@ -16,12 +29,36 @@ def _cors_json(payload, status=200):
     resp.headers["Pragma"] = "no-cache"
     return resp
 
+def _unauthorized():
+    if JOB_TOKEN:
+        got = (request.headers.get("X-Job-Token") or "").strip()
+        if got != JOB_TOKEN:
+            return _cors_json({"ok": False, "error": "unauthorized"}, 401)
+    return None
+
+def _run_job():
+    try:
+        return run_once()
+    except Exception as e:
+        app.logger.exception(f"[ERROR] run_once: {e}")
+        raise
+
+def _submit_job() -> str:
+    now = time.monotonic()
+    job_id = uuid4().hex
+    with _JOBS_LOCK:
+        for k, (ts, fut) in list(JOBS.items()):
+            if fut.done() and now - ts > JOB_TTL_SECONDS:
+                del JOBS[k]
+        JOBS[job_id] = (now, _EXECUTOR.submit(_run_job))
+    return job_id
+
 @app.get("/")
 def home():
     return _cors_json({
         "ok": True,
         "service": "tdlm-content-bot",
-        "hint": "Usa POST /run_once para publicar 1 fila READY."
+        "hint": "Usa POST /run_once para publicar 1 fila READY (202 + job_id); consulta GET /run_once/<job_id>."
     })
 
 @app.get("/health")
@@ -33,17 +70,44 @@ def run_once_route():
     if request.method == "OPTIONS":
         return _cors_json({"ok": True})
 
-    if JOB_TOKEN:
-        got = (request.headers.get("X-Job-Token") or "").strip()
-        if got != JOB_TOKEN:
-            return _cors_json({"ok": False, "error": "unauthorized"}, 401)
+    denied = _unauthorized()
+    if denied:
+        return denied
+
+    job_id = _submit_job()
+
+    # compatibilidad: ?wait=1 conserva el comportamiento bloqueante
+    if request.args.get("wait") == "1":
+        return _job_response(job_id, wait=True)
+
+    return _cors_json({"ok": True, "job_id": job_id, "status": "queued"}, 202)
+
+@app.route("/run_once/<job_id>", methods=["GET", "OPTIONS"])
+def run_once_status_route(job_id):
+    if request.method == "OPTIONS":
+        return _cors_json({"ok": True})
+
+    denied = _unauthorized()
+    if denied:
+        return denied
+
+    return _job_response(job_id)
+
+def _job_response(job_id: str, wait: bool = False):
+    with _JOBS_LOCK:
+        entry = JOBS.get(job_id)
+    if not entry:
+        return _cors_json({"ok": False, "error": "job_not_found"}, 404)
+
+    fut = entry[1]
+    if not (wait or fut.done()):
+        return _cors_json({"ok": True, "job_id": job_id, "status": "running"}, 202)
 
     try:
-        result = run_once()
-        return _cors_json({"ok": True, "result": result}, 200)
+        result = fut.result()
+        return _cors_json({"ok": True, "job_id": job_id, "status": "done", "result": result}, 200)
     except Exception as e:
-        app.logger.exception(f"[ERROR] run_once: {e}")
-        return _cors_json({"ok": False, "error": f"{type(e).__name__}: {e}"}, 500)
+        return _cors_json({"ok": False, "job_id": job_id, "status": "error", "error": f"{type(e).__name__}: {e}"}, 500)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "10000"))
@@ -1,24 +1,41 @@
 import os
-import json
+import re
+import time
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from openai import OpenAI
+try:
+    import orjson as _json  # parser rápido (Rust); acepta str o bytes
+except ImportError:
+    import json as _json
 
 from utils.sheets import (
     open_spreadsheet, open_worksheet, build_header_map, col_idx,
-    get_all_values_safe, row_to_dict, with_backoff, update_row_cells
+    get_all_values_safe, row_to_dict, with_backoff, update_row_cells,
+    get_cell_safe
 )
 from utils.wp import WordPressClient
 
 MX_TZ = ZoneInfo(os.environ.get("TZ", "America/Mexico_City").strip() or "America/Mexico_City")
 
+CONTENT_SHEET_KEY = os.environ.get("CONTENT_SHEET_KEY", "").strip()  # preferido: evita búsqueda en Drive
 CONTENT_SHEET_NAME = os.environ.get("CONTENT_SHEET_NAME", "").strip()
 TAB_CONTENT_PLAN = os.environ.get("TAB_CONTENT_PLAN", "Content_Plan").strip()
 TAB_KNOWLEDGE = os.environ.get("TAB_KNOWLEDGE", "Conocimiento_AI").strip()
+KNOWLEDGE_CACHE_TTL = int(os.environ.get("KNOWLEDGE_CACHE_TTL", "600").strip() or "600")  # segundos
+# opcional: celda de Conocimiento_AI que cambia cuando cambia la pestaña, p. ej.
+# Z1 con =SUMPRODUCT(LEN(A:E)); si está definida se revisa en cada run
+KNOWLEDGE_VERSION_CELL = os.environ.get("KNOWLEDGE_VERSION_CELL", "").strip()
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "").strip()
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini").strip()
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "60").strip() or "60")  # segundos
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", "3").strip() or "3")
+OPENAI_MAX_TOKENS = int(os.environ.get("OPENAI_MAX_TOKENS", "4000").strip() or "4000")  # tope de salida
+KNOWLEDGE_MAX_CHARS = int(os.environ.get("KNOWLEDGE_MAX_CHARS", "1200").strip() or "1200")  # por fuente en el prompt
 
 WP_BASE_URL = os.environ.get("WP_BASE_URL", "").strip()
 WP_USER = os.environ.get("WP_USER", "").strip()
@@ -28,37 +45,125 @@ DEFAULT_WP_STATUS = (os.environ.get("DEFAULT_WP_STATUS", "draft").strip() or "dr
 CTA_WHATSAPP = os.environ.get("CTA_WHATSAPP", "").strip()  # opcional: link wa.me
 CTA_ABOGADOS_URL = os.environ.get("CTA_ABOGADOS_URL", "https://tuderecholaboralmexico.com/abogados/").strip()
 
+# Conocimiento_AI cambia poco: se cachea en proceso por KNOWLEDGE_CACHE_TTL y,
+# si hay KNOWLEDGE_VERSION_CELL, se invalida antes cuando cambia esa celda.
+# (El modifiedTime del spreadsheet no sirve: lo cambian nuestras propias
+# escrituras en Content_Plan.)
+_K_CACHE = {"at": 0.0, "version": None, "rows": None, "tokens": None, "id_index": None}
+_K_LOCK = threading.Lock()
+
+# filas tomadas por runs en curso de este proceso (gunicorn gthread): evita
+# que dos requests simultáneos publiquen la misma fila READY
+_CLAIMED: set[int] = set()
+_CLAIM_LOCK = threading.Lock()
+
+_OAI = None
+_OAI_LOCK = threading.Lock()
+
+# Structured Outputs: el modelo solo puede devolver este objeto
+POST_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "post",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "title": {"type": "string"},
+                "excerpt": {"type": "string"},
+                "html": {"type": "string"},
+            },
+            "required": ["title", "excerpt", "html"],
+            "additionalProperties": False,
+        },
+    },
+}
+
 def now_iso():
     return datetime.now(MX_TZ).strftime("%Y-%m-%dT%H:%M:%S%z")
 
 def _norm(s: str) -> str:
     return (s or "").strip()
 
-def _pick_knowledge(knowledge_rows: list[dict], tema: str, palabras: str, id_tema_ai: str) -> list[dict]:
-    if id_tema_ai:
-        for r in knowledge_rows:
-            if _norm(r.get("ID_Tema")) == _norm(id_tema_ai):
-                return [r]
+_TOKEN_SPLIT = re.compile(r"[,\s]+")
+
+def _tokens(text: str) -> frozenset[str]:
+    return frozenset(t for t in _TOKEN_SPLIT.split((text or "").lower()) if len(t) >= 4)
 
-    q = f"{tema} {palabras}".lower()
-    q_tokens = set([t for t in q.replace(",", " ").split() if len(t) >= 4])
+def _knowledge_tokens(r: dict) -> frozenset[str]:
+    return _tokens(f"{r.get('Titulo_Visible','')} {r.get('Palabras_Clave','')} {r.get('Contenido_Legal','')}")
+
+def _load_knowledge(sh) -> tuple[list[dict], list[frozenset[str]], dict[str, dict]]:
+    """
+    Filas de Conocimiento_AI + sus tokens + índice por ID_Tema
+    (precalculados una sola vez por versión).
+    """
+    with _K_LOCK:
+        fresh = (
+            _K_CACHE["rows"] is not None
+            and time.monotonic() - _K_CACHE["at"] < KNOWLEDGE_CACHE_TTL
+        )
+        # la versión se lee ANTES del GET: una edición entre ambos deja el
+        # cache con filas nuevas y versión vieja -> el siguiente run recarga
+        version = get_cell_safe(sh, TAB_KNOWLEDGE, KNOWLEDGE_VERSION_CELL) if KNOWLEDGE_VERSION_CELL else None
+        if fresh and (not KNOWLEDGE_VERSION_CELL or (version is not None and version == _K_CACHE["version"])):
+            return _K_CACHE["rows"], _K_CACHE["tokens"], _K_CACHE["id_index"]
+
+        ws_k = open_worksheet(sh, TAB_KNOWLEDGE)
+        k_values = get_all_values_safe(ws_k)
+        knowledge_rows = []
+        if k_values and len(k_values) >= 2:
+            kh = k_values[0]
+            for rr in k_values[1:]:
+                knowledge_rows.append(row_to_dict(kh, rr))
+        knowledge_tokens = [_knowledge_tokens(r) for r in knowledge_rows]
+        id_index = {}
+        for r in knowledge_rows:
+            id_index.setdefault(_norm(r.get("ID_Tema")), r)  # gana la primera
+        id_index.pop("", None)
+
+        if k_values:  # no cachear una lectura fallida
+            _K_CACHE.update(
+                at=time.monotonic(), version=version,
+                rows=knowledge_rows, tokens=knowledge_tokens, id_index=id_index,
+            )
+        return knowledge_rows, knowledge_tokens, id_index
+
+def _pick_knowledge(
+    knowledge_rows: list[dict],
+    knowledge_tokens: list[frozenset[str]],
+    id_index: dict[str, dict],
+    tema: str,
+    palabras: str,
+    id_tema_ai: str,
+) -> list[dict]:
+    hit = id_index.get(_norm(id_tema_ai)) if id_tema_ai else None
+    if hit:
+        return [hit]
+
+    q_tokens = _tokens(f"{tema} {palabras}")
+
+    if not q_tokens:
+        return []
 
     scored = []
-    for r in knowledge_rows:
-        text = f"{r.get('Titulo_Visible','')} {r.get('Palabras_Clave','')} {r.get('Contenido_Legal','')}".lower()
-        tokens = set([t for t in text.replace(",", " ").split() if len(t) >= 4])
-        score = len(q_tokens.intersection(tokens))
+    for r, tokens in zip(knowledge_rows, knowledge_tokens):
+        score = len(q_tokens & tokens)
         if score > 0:
             scored.append((score, r))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [x[1] for x in scored[:2]]  # top 2
+    return [x[1] for x in heapq.nlargest(2, scored, key=lambda x: x[0])]  # top 2
+
+def _clip(s: str, n: int = KNOWLEDGE_MAX_CHARS) -> str:
+    # corta en el último punto antes de n (o en n si no hay)
+    s = s or ""
+    return s if len(s) <= n else s[:s.rfind(".", 0, n) + 1 or n]
 
 def _compose_prompt(tema: str, palabras: str, knowledge: list[dict]) -> str:
     base = ""
     for k in knowledge:
         base += (
             f"- TEMA_BASE: {k.get('Titulo_Visible','')}\n"
-            f"  CONTENIDO_LEGAL: {k.get('Contenido_Legal','')}\n"
+            f"  CONTENIDO_LEGAL: {_clip(k.get('Contenido_Legal',''))}\n"
             f"  FUENTE: {k.get('Fuente','')}\n\n"
         )
 
@@ -100,68 +205,120 @@ RESTRICCIONES:
 - Incluye disclaimer al final
 """.strip()
 
+def _oai():
+    """
+    Cliente OpenAI único por proceso: reutiliza el pool httpx (TLS/keep-alive)
+    entre runs. Se crea en el primer uso, no al importar.
+    """
+    global _OAI
+    with _OAI_LOCK:
+        if _OAI is None:
+            # import diferido: openai arrastra httpx/pydantic (lento en arranque en frío)
+            import httpx
+            from openai import OpenAI
+
+            # timeout explícito: sin él un pico de latencia de OpenAI cuelga el worker
+            _OAI = OpenAI(
+                api_key=OPENAI_API_KEY,
+                timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=5.0),
+                max_retries=OPENAI_MAX_RETRIES,
+            )
+        return _OAI
+
 def _openai_generate_post(tema: str, palabras: str, knowledge: list[dict]) -> dict:
     if not OPENAI_API_KEY:
         raise RuntimeError("Falta OPENAI_API_KEY")
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    prompt = _compose_prompt(tema, palabras, knowledge)
+    from openai import OpenAIError
 
-    resp = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": "Responde siempre en JSON válido, sin markdown."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.5,
-    )
+    client = _oai()
+    prompt = _compose_prompt(tema, palabras, knowledge)
 
-    content = (resp.choices[0].message.content or "").strip()
     try:
-        return json.loads(content)
-    except Exception:
-        # fallback: si vino texto, no tiramos el flujo sin razón
-        return {
-            "title": tema[:120],
-            "excerpt": "Guía informativa y orientativa sobre tu situación laboral.",
-            "html": f"<p>{content}</p>"
-        }
+        resp = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": "Responde siempre en JSON válido, sin markdown."},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.5,
+            max_tokens=OPENAI_MAX_TOKENS,
+            response_format=POST_RESPONSE_FORMAT,
+            stream=True,
+        )
+
+        # streaming: la respuesta se acumula conforme llega (el resto del I/O
+        # de run_once corre en paralelo mientras tanto)
+        parts = []
+        refusal = []
+        finish_reason = None
+        for chunk in resp:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                parts.append(delta.content)
+            if getattr(delta, "refusal", None):  # Structured Outputs: rechazo del modelo
+                refusal.append(delta.refusal)
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+    except OpenAIError as e:
+        raise RuntimeError(f"OpenAI no respondió ({type(e).__name__}): {e}") from e
+
+    if refusal or finish_reason == "content_filter":
+        detalle = "".join(refusal).strip() or "content_filter"
+        raise RuntimeError(f"OpenAI rechazó generar el post: {detalle}")
+    if finish_reason == "length":
+        raise RuntimeError(f"Respuesta de OpenAI truncada en {OPENAI_MAX_TOKENS} tokens (sube OPENAI_MAX_TOKENS)")
+
+    # json_schema (strict) garantiza JSON válido con estas llaves: sin fallback
+    return _json.loads("".join(parts))
 
 def run_once():
-    if not CONTENT_SHEET_NAME:
-        raise RuntimeError("Falta CONTENT_SHEET_NAME")
+    if not (CONTENT_SHEET_KEY or CONTENT_SHEET_NAME):
+        raise RuntimeError("Falta CONTENT_SHEET_KEY (o CONTENT_SHEET_NAME)")
 
-    sh = open_spreadsheet(CONTENT_SHEET_NAME)
+    sh = open_spreadsheet(CONTENT_SHEET_KEY or CONTENT_SHEET_NAME)
     ws_plan = open_worksheet(sh, TAB_CONTENT_PLAN)
 
-    values = get_all_values_safe(ws_plan)
-    if not values or len(values) < 2:
+    h = build_header_map(ws_plan)
+    if not h:
         return {"status": "no_rows"}
 
-    hdr = values[0]
-    rows = values[1:]
+    # buscar primera fila READY leyendo solo la columna Estatus
+    estatus = with_backoff(ws_plan.col_values, col_idx(h, "Estatus"))
+    if len(estatus) < 2:
+        return {"status": "no_rows"}
 
-    # buscar primera fila READY
     target_idx = None
-    target_row = None
-    for i, r in enumerate(rows, start=2):  # row number in sheet
-        d = row_to_dict(hdr, r)
-        if _norm(d.get("Estatus")).upper() == "READY":
-            target_idx = i
-            target_row = d
-            break
+    with _CLAIM_LOCK:
+        for i, v in enumerate(estatus[1:], start=2):  # row number in sheet
+            if _norm(v).upper() == "READY" and i not in _CLAIMED:
+                target_idx = i
+                _CLAIMED.add(i)
+                break
 
     if not target_idx:
         return {"status": "nothing_ready"}
 
-    h = build_header_map(ws_plan)
-
-    # marcar RUNNING
-    update_row_cells(ws_plan, target_idx, {
-        "Estatus": "RUNNING",
-        "Ultimo_Error": "",
-        "Actualizado_En": now_iso(),
-    }, hmap=h)
+    try:
+        return _publish_row(sh, ws_plan, h, target_idx)
+    except Exception as e:
+        # que el fallo quede visible en la hoja (si no, la fila se queda en RUNNING)
+        try:
+            update_row_cells(ws_plan, target_idx, {
+                "Estatus": "ERROR",
+                "Ultimo_Error": f"{type(e).__name__}: {e}"[:500],
+                "Actualizado_En": now_iso(),
+            }, hmap=h)
+        except Exception:
+            pass
+        raise
+    finally:
+        with _CLAIM_LOCK:
+            _CLAIMED.discard(target_idx)
+
+def _publish_row(sh, ws_plan, h: dict, target_idx: int) -> dict:
+    target_row = row_to_dict(h, with_backoff(ws_plan.row_values, target_idx))
 
     tema = _norm(target_row.get("Tema"))
     palabras = _norm(target_row.get("Palabras_Clave"))
@@ -169,32 +326,36 @@ def run_once():
     wp_status = _norm(target_row.get("WP_Estatus")) or DEFAULT_WP_STATUS
     id_tema_ai = _norm(target_row.get("ID_Tema_AI"))
 
-    # leer conocimiento
-    ws_k = open_worksheet(sh, TAB_KNOWLEDGE)
-    k_values = get_all_values_safe(ws_k)
-    knowledge_rows = []
-    if k_values and len(k_values) >= 2:
-        kh = k_values[0]
-        for rr in k_values[1:]:
-            knowledge_rows.append(row_to_dict(kh, rr))
+    if not (WP_BASE_URL and WP_USER and WP_APP_PASSWORD):
+        raise RuntimeError("Faltan variables WP_BASE_URL / WP_USER / WP_APP_PASSWORD")
+
+    wp = WordPressClient(WP_BASE_URL, WP_USER, WP_APP_PASSWORD)
 
-    picked = _pick_knowledge(knowledge_rows, tema, palabras, id_tema_ai)
+    # I/O independiente en paralelo: marcar RUNNING, leer conocimiento y
+    # resolver la categoría WP mientras GPT genera el post.
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        f_mark = ex.submit(update_row_cells, ws_plan, target_idx, {
+            "Estatus": "RUNNING",
+            "Ultimo_Error": "",
+            "Actualizado_En": now_iso(),
+        }, hmap=h)
+        f_k = ex.submit(_load_knowledge, sh)
+        f_cat = ex.submit(wp.get_or_create_category, wp_cat) if wp_cat else None
+
+        knowledge_rows, knowledge_tokens, id_index = f_k.result()
+        picked = _pick_knowledge(knowledge_rows, knowledge_tokens, id_index, tema, palabras, id_tema_ai)
+
+        # GPT genera post
+        post = _openai_generate_post(tema, palabras, picked)
+
+        f_mark.result()
+        cat_id = f_cat.result() if f_cat else None
 
-    # GPT genera post
-    post = _openai_generate_post(tema, palabras, picked)
     title = _norm(post.get("title")) or tema
     excerpt = _norm(post.get("excerpt")) or ""
     html = _norm(post.get("html")) or ""
 
     # publicar en WordPress
-    if not (WP_BASE_URL and WP_USER and WP_APP_PASSWORD):
-        raise RuntimeError("Faltan variables WP_BASE_URL / WP_USER / WP_APP_PASSWORD")
-
-    wp = WordPressClient(WP_BASE_URL, WP_USER, WP_APP_PASSWORD)
-    cat_id = None
-    if wp_cat:
-        cat_id = wp.get_or_create_category(wp_cat)
-
     created = wp.create_post(
         title=title,
         content_html=html,
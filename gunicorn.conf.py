@@ -0,0 +1,16 @@
+# gunicorn.conf.py
+# Se carga automáticamente al correr:  gunicorn app:app
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+# Hilos (gthread) para que varios /run_once esperen I/O (OpenAI, Sheets, WP)
+# sin bloquearse entre sí. Un solo proceso por defecto: el "claim" de filas
+# READY (content_bot._CLAIMED) y los jobs de /run_once (app.JOBS) viven en
+# memoria y no se comparten entre procesos.
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# OpenAI puede tardar minutos en la cola larga
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "180"))
@@ -1,15 +1,26 @@
 # utils/sheets.py
+from __future__ import annotations
+
 import os
-import json
 import time
 import random
 import base64
 import ast
-from typing import Any, Dict, Optional, Callable, List
+import re
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional, Callable, List, Tuple, Union
+
+import requests
+
+# gspread / google-auth se importan dentro de las funciones que los usan:
+# así /health y los 401 no pagan su tiempo de import en un arranque en frío.
+if TYPE_CHECKING:
+    import gspread
 
-import gspread
-from gspread.exceptions import WorksheetNotFound
-from google.oauth2.service_account import Credentials
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
 
 
 DEFAULT_SCOPES = [
@@ -17,6 +28,16 @@ DEFAULT_SCOPES = [
     "https://www.googleapis.com/auth/drive",
 ]
 
+# Cache en proceso: evita re-autenticar y re-abrir el spreadsheet en cada run.
+# Se renueva antes de que expire el token OAuth (~60 min).
+CACHE_TTL_SECONDS = 50 * 60
+_GC_CACHE: Dict[Tuple[str, ...], Tuple[float, gspread.Client]] = {}
+_SH_CACHE: Dict[str, Tuple[float, gspread.Spreadsheet]] = {}
+_CACHE_LOCK = threading.RLock()  # gunicorn gthread: una sola autenticación a la vez
+
+# IDs de Google Sheets: 44 caracteres [A-Za-z0-9_-]
+_SHEET_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{40,}$")
+
 
 def _env(name: str, default: str = "") -> str:
     return (os.environ.get(name, default) or "").strip()
@@ -84,11 +105,12 @@ def _load_creds_info() -> Dict[str, Any]:
 
     # 1) JSON estándar
     try:
-        info = json.loads(raw)
+        info = _json.loads(raw)
         if not isinstance(info, dict):
             raise RuntimeError("Las credenciales no son un objeto JSON (dict).")
         return info
-    except json.JSONDecodeError:
+    except ValueError:
+        # json.JSONDecodeError y orjson.JSONDecodeError heredan de ValueError
         pass
 
     # 2) dict estilo Python (comillas simples)
@@ -106,48 +128,99 @@ def _load_creds_info() -> Dict[str, Any]:
         ) from e
 
 
+def _fresh(entry: Optional[Tuple[float, Any]]) -> bool:
+    return bool(entry) and (time.monotonic() - entry[0]) < CACHE_TTL_SECONDS
+
+
 def get_gspread_client(scopes: Optional[list] = None) -> gspread.Client:
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     scopes = scopes or DEFAULT_SCOPES
-    info = _load_creds_info()
-    creds = Credentials.from_service_account_info(info, scopes=scopes)
-    return gspread.authorize(creds)
+    key = tuple(scopes)
+    with _CACHE_LOCK:
+        hit = _GC_CACHE.get(key)
+        if _fresh(hit):
+            return hit[1]
+
+        info = _load_creds_info()
+        creds = Credentials.from_service_account_info(info, scopes=scopes)
+        gc = gspread.authorize(creds)
+        _GC_CACHE[key] = (time.monotonic(), gc)
+        return gc
+
+
+_TRANSIENT_STATUS = (429, 500, 502, 503, 504)
 
 
-def with_backoff(fn: Callable, *args, tries: int = 5, base_sleep: float = 0.7, **kwargs):
+def _is_transient(e: Exception) -> bool:
+    from gspread.exceptions import APIError
+
+    if isinstance(e, APIError):
+        return getattr(e.response, "status_code", None) in _TRANSIENT_STATUS
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, TimeoutError))
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    resp = getattr(e, "response", None)
+    try:
+        return min(float(resp.headers["Retry-After"]), 30.0)
+    except Exception:
+        return None
+
+
+def with_backoff(fn: Callable, *args, tries: int = 3, base_sleep: float = 0.7, **kwargs):
     """
-    Reintentos simples con backoff para llamadas a gspread/Google APIs.
+    Reintentos con backoff para llamadas a gspread/Google APIs.
+    Solo reintenta errores transitorios (429/5xx, red, timeout); el resto falla
+    de inmediato. Respeta Retry-After cuando viene en la respuesta.
     """
-    last_err = None
     for i in range(tries):
         try:
             return fn(*args, **kwargs)
         except Exception as e:
-            last_err = e
-            time.sleep(base_sleep * (2 ** i) + random.random() * 0.25)
-    raise last_err
+            if not _is_transient(e) or i == tries - 1:
+                raise
+            sleep = _retry_after(e)
+            if sleep is None:
+                sleep = base_sleep * (2 ** i) + random.random() * 0.25
+            time.sleep(sleep)
 
 
 def open_spreadsheet(name_or_key_or_url: str) -> gspread.Spreadsheet:
-    gc = get_gspread_client()
     s = (name_or_key_or_url or "").strip()
+    with _CACHE_LOCK:
+        hit = _SH_CACHE.get(s)
+        if _fresh(hit):
+            return hit[1]
+
+        sh = _open_spreadsheet_uncached(get_gspread_client(), s)
+        _SH_CACHE[s] = (time.monotonic(), sh)
+        return sh
 
+
+def _open_spreadsheet_uncached(gc: gspread.Client, s: str) -> gspread.Spreadsheet:
     # URL
     if "docs.google.com" in s and "/spreadsheets/d/" in s:
         return with_backoff(gc.open_by_url, s)
 
-    # Key
+    # Key (formato inequívoco): directo, sin búsqueda en Drive
+    if _SHEET_KEY_RE.match(s):
+        return with_backoff(gc.open_by_key, s)
+
+    # Key (heurística)
     if len(s) >= 25 and all(c.isalnum() or c in "-_" for c in s):
         try:
             return with_backoff(gc.open_by_key, s)
         except Exception:
             pass
 
-    # Nombre
+    # Nombre (lo más lento: files.list en Drive)
     return with_backoff(gc.open, s)
 
 
 def open_worksheet(
-    spreadsheet_name_or_key_or_url: str,
+    spreadsheet_name_or_key_or_url: Union[str, gspread.Spreadsheet],
     worksheet_title: str,
     create_if_missing: bool = False,
     rows: int = 1000,
@@ -155,8 +228,15 @@ def open_worksheet(
 ) -> gspread.Worksheet:
     """
     Compatibilidad: tu código importa open_worksheet desde utils.sheets.
+    Acepta nombre/key/URL o un Spreadsheet ya abierto (evita re-abrirlo).
     """
-    sh = open_spreadsheet(spreadsheet_name_or_key_or_url)
+    import gspread
+    from gspread.exceptions import WorksheetNotFound
+
+    if isinstance(spreadsheet_name_or_key_or_url, gspread.Spreadsheet):
+        sh = spreadsheet_name_or_key_or_url
+    else:
+        sh = open_spreadsheet(spreadsheet_name_or_key_or_url)
     try:
         return with_backoff(sh.worksheet, worksheet_title)
     except WorksheetNotFound:
@@ -165,9 +245,16 @@ def open_worksheet(
         return with_backoff(sh.add_worksheet, title=worksheet_title, rows=rows, cols=cols)
 
 
+def header_map_from_row(hdr: List[str]) -> Dict[str, int]:
+    """
+    Header map {nombre: columna (1-based)} desde una fila de encabezados ya
+    leída (p. ej. values[0]); no hace llamadas a la API.
+    """
+    return {h.strip(): (i + 1) for i, h in enumerate(hdr) if (h or "").strip()}
+
+
 def build_header_map(ws: gspread.Worksheet) -> Dict[str, int]:
-    headers = with_backoff(ws.row_values, 1)
-    return {h.strip(): (i + 1) for i, h in enumerate(headers) if (h or "").strip()}
+    return header_map_from_row(with_backoff(ws.row_values, 1))
 
 
 def col_idx(header_map: Dict[str, int], header_name: str) -> int:
@@ -181,6 +268,44 @@ def col_idx(header_map: Dict[str, int], header_name: str) -> int:
     raise KeyError(f"Columna no encontrada en encabezados: {header_name}")
 
 
+def row_to_dict(headers: Union[List[str], Dict[str, int]], row: List[str]) -> Dict[str, str]:
+    """
+    Convierte una fila en dict {encabezado: valor}.
+    headers puede ser la fila de encabezados o un header_map {nombre: columna}.
+    Celdas faltantes (gspread recorta vacías al final) se devuelven como "".
+    """
+    hmap = headers if isinstance(headers, dict) else header_map_from_row(headers)
+    return {k: (row[c - 1] if c <= len(row) else "") for k, c in hmap.items()}
+
+
+def update_row_cells(
+    ws: gspread.Worksheet,
+    row_num: int,
+    updates: Dict[str, Any],
+    hmap: Optional[Dict[str, int]] = None,
+    value_input_option: str = "USER_ENTERED",
+) -> None:
+    """
+    Actualiza varias columnas de una fila en UNA sola llamada (batch_update).
+    Las columnas que no existen en el encabezado se ignoran.
+    """
+    from gspread.utils import rowcol_to_a1
+
+    hmap = hmap or build_header_map(ws)
+    data = []
+    for k, v in updates.items():
+        try:
+            c = col_idx(hmap, k)
+        except KeyError:
+            continue
+        data.append({"range": rowcol_to_a1(row_num, c), "values": [[v]]})
+    if not data:
+        return
+    # gspread reescribe data[i]["range"] in-place (le antepone la hoja):
+    # cada intento necesita su propia copia o el reintento manda 'Hoja'!'Hoja'!A1
+    with_backoff(lambda: ws.batch_update([dict(d) for d in data], value_input_option=value_input_option))
+
+
 # =========================================================
 # Helpers "safe" (los pide tu content_bot.py)
 # =========================================================
@@ -207,6 +332,19 @@ def update_cell_safe(ws: gspread.Worksheet, row: int, col: int, value: Any) -> N
     with_backoff(ws.update_cell, row, col, value)
 
 
+def get_cell_safe(sh: gspread.Spreadsheet, worksheet_title: str, a1: str) -> Optional[str]:
+    """
+    Valor de una sola celda (una llamada values.get, sin abrir la pestaña).
+    Celda vacía -> "". Si falla, regresa None.
+    """
+    try:
+        res = with_backoff(sh.values_get, f"'{worksheet_title}'!{a1}")
+    except Exception:
+        return None
+    values = res.get("values") or [[""]]
+    return str(values[0][0]) if values[0] else ""
+
+
 def append_row_safe(ws: gspread.Worksheet, values: List[Any], value_input_option: str = "RAW") -> None:
     # gspread: append_row(values, value_input_option=...)
     with_backoff(ws.append_row, values, value_input_option=value_input_option)
@@ -1,33 +1,80 @@
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 
 class WordPressClient:
+    # cache de categorías compartido entre instancias:
+    #   {(base_url, nombre_lower): (guardado_en, id)}  +  ETag de la búsqueda
+    # Al vencer el TTL se revalida con If-None-Match: un 304 confirma el id sin
+    # transferir ni parsear el body.
+    CAT_CACHE_TTL = 60 * 60
+    _cat_cache: dict = {}
+    _cat_etag: dict = {}
+
     def __init__(self, base_url: str, user: str, app_password: str):
         self.base_url = base_url.rstrip("/")
         self.auth = HTTPBasicAuth(user, app_password)
 
+        # una sola conexión keep-alive para todas las llamadas del run
+        self.s = requests.Session()
+        self.s.auth = self.auth
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,  # deja que raise_for_status() reporte el error
+        )  # por defecto no reintenta POST (evita posts duplicados)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry)
+        self.s.mount("https://", adapter)
+        self.s.mount("http://", adapter)
+
     def _url(self, path: str) -> str:
         return f"{self.base_url}{path}"
 
     def get_or_create_category(self, name: str) -> int:
-        # busca por nombre
-        r = requests.get(
+        key = (self.base_url, name.strip().lower())
+        cached = self._cat_cache.get(key)
+        if cached and time.monotonic() - cached[0] < self.CAT_CACHE_TTL:
+            return cached[1]
+
+        cat_id = self._find_or_create_category(name, key, cached[1] if cached else None)
+        if cat_id:  # nunca cachear un id vacío
+            self._cat_cache[key] = (time.monotonic(), cat_id)
+        return cat_id
+
+    def _find_or_create_category(self, name: str, key: tuple, cached_id=None) -> int:
+        # busca por nombre (condicional si ya la habíamos resuelto)
+        headers = {}
+        etag = self._cat_etag.get(key) if cached_id else None
+        if etag:
+            headers["If-None-Match"] = etag
+        r = self.s.get(
             self._url("/wp-json/wp/v2/categories"),
             params={"search": name, "per_page": 50},
-            auth=self.auth,
+            headers=headers,
             timeout=30
         )
+        if r.status_code == 304 and cached_id:
+            return cached_id
+
         r.raise_for_status()
         cats = r.json() or []
         for c in cats:
             if (c.get("name") or "").strip().lower() == name.strip().lower():
+                # solo se guarda el ETag de una respuesta que contiene la categoría
+                if r.headers.get("ETag"):
+                    self._cat_etag[key] = r.headers["ETag"]
                 return int(c["id"])
 
+        self._cat_etag.pop(key, None)
+
         # crea
-        r2 = requests.post(
+        r2 = self.s.post(
             self._url("/wp-json/wp/v2/categories"),
             json={"name": name},
-            auth=self.auth,
             timeout=30
         )
         r2.raise_for_status()
@@ -44,10 +91,9 @@ class WordPressClient:
         if category_id:
             payload["categories"] = [int(category_id)]
 
-        r = requests.post(
+        r = self.s.post(
             self._url("/wp-json/wp/v2/posts"),
             json=payload,
-            auth=self.auth,
             timeout=60
         )
         r.raise_for_status()